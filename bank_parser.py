@@ -1,48 +1,239 @@
 import pdfplumber
 import pandas as pd
+import multiprocessing
 import re
+import threading
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
-from typing import List, Dict
+from functools import lru_cache
+from multiprocessing import cpu_count
+from typing import List, Optional, Tuple
+from transaction import Txn
+
+try:
+    import pymupdf
+
+    HAS_PYMUPDF = True
+except ImportError:
+    HAS_PYMUPDF = False
+
+# Common patterns for transaction lines (including French dates). They run
+# over a whole page of text, so whitespace never includes newlines.
+_DATE_RE = re.compile(
+    r"\d{1,2}(?:[^\S\n]|\.)+(janv|févr|mars|avr|mai|juin|juil|août|"
+    r"sept|oct|nov|déc)(?:[^\S\n]|\.)+\d{2,4}|\d{1,2}[/-]\d{1,2}[/-]\d{2,4}",
+    re.IGNORECASE,
+)
+_AMOUNT_RE = re.compile(r"€?[^\S\n]*\d+[.,]\d+")
+_NEWLINE_RE = re.compile(r"\n")
+_LONG_NUM_RE = re.compile(r"\d{4,}")
+_AMOUNT_TRANS = str.maketrans("", "", "$€£, \t")
+
+# French month abbreviations (map to English for dateutil)
+_MONTH_MAP = {
+    "janv": "january",
+    "févr": "february",
+    "fév": "february",
+    "mars": "march",
+    "avr": "april",
+    "mai": "may",
+    "juin": "june",
+    "juil": "july",
+    "août": "august",
+    "sept": "september",
+    "oct": "october",
+    "nov": "november",
+    "déc": "december",
+}
+# Longer abbreviations first to avoid partial matches
+_FR_MONTH_RE = re.compile("|".join(sorted(_MONTH_MAP, key=len, reverse=True)))
+
+# Pages each PDF worker extracts ahead of the one it is parsing
+_PREFETCH_PAGES = 2
+
+# PDFs with fewer pages are parsed inline; at ~30ms per page the worker
+# pool's dispatch cost (~5ms per job) isn't worth paying for them
+_PDF_POOL_MIN_PAGES = 4
+
+# Header/summary lines to skip in text statements
+_SKIP_KEYWORDS = [
+    "Relevé",
+    "Généré le",
+    "Transactions du compte",
+    "Date",
+    "Description",
+    "Argent sortant",
+    "Argent entrant",
+    "Solde",
+    "Résumé",
+    "COMPTE",
+    "TOTAL",
+    "Renvoyé",
+    "Page",
+]
+_SKIP_RE = re.compile("|".join(re.escape(kw) for kw in _SKIP_KEYWORDS))
+
+
+@lru_cache(maxsize=4096)
+def _cached_parse(date_str: str) -> datetime:
+    """Parse a date string with dateutil, memoized per distinct string"""
+    from dateutil import parser
+
+    return parser.parse(date_str)
+
+
+@lru_cache(maxsize=8192)
+def _merchant_core(description: str) -> str:
+    """Merchant name for a description (recurring charges repeat it verbatim)"""
+    # Common patterns: "MERCHANT NAME", "Merchant Name", etc.
+    # Return first meaningful words (up to 3 words typically), stopping
+    # as soon as we have them
+    words = []
+    for word in description.split():
+        # Remove transaction codes, card numbers, etc.
+        if word.isdecimal():
+            if len(word) >= 4:
+                continue
+        elif _LONG_NUM_RE.search(word):
+            word = _LONG_NUM_RE.sub("", word)
+            if not word:
+                continue
+
+        words.append(word.upper())
+        if len(words) == 3:
+            break
+
+    return " ".join(words) if words else description[:30]
 
 
 class BankStatementParser:
     """Parse bank statements from PDF or CSV files"""
 
     def __init__(self):
-        self.transactions = []
-
-    def parse_pdf(self, file_path: str) -> List[Dict]:
+        # Worker processes for large PDFs, started on first use and kept
+        # until close()
+        self._pdf_pool = None
+        self._pdf_pool_lock = threading.Lock()
+
+    def close(self):
+        """Stop the PDF worker processes"""
+        with self._pdf_pool_lock:
+            pool, self._pdf_pool = self._pdf_pool, None
+        if pool is not None:
+            pool.shutdown()
+
+    def _get_pdf_pool(self) -> ProcessPoolExecutor:
+        """The PDF worker pool, started on first use"""
+        with self._pdf_pool_lock:
+            if self._pdf_pool is None:
+                # Workers come from a forkserver (spawn where there is none):
+                # forking this multi-threaded server directly could copy a
+                # lock some other thread is holding
+                if "forkserver" in multiprocessing.get_all_start_methods():
+                    context = multiprocessing.get_context("forkserver")
+                    context.set_forkserver_preload([__name__])
+                else:
+                    context = multiprocessing.get_context("spawn")
+                self._pdf_pool = ProcessPoolExecutor(cpu_count(), mp_context=context)
+            return self._pdf_pool
+
+    def parse_pdf(self, file_path: str) -> List[Txn]:
         """Extract transactions from PDF bank statement"""
+        if HAS_PYMUPDF:
+            with pymupdf.open(file_path) as doc:
+                page_count = doc.page_count
+        else:
+            with pdfplumber.open(file_path) as pdf:
+                page_count = len(pdf.pages)
+
+        if page_count < _PDF_POOL_MIN_PAGES or cpu_count() == 1:
+            return _extract_pages((file_path, 0, page_count))
+
+        # Page layout analysis is CPU-bound; spread contiguous page ranges
+        # over the worker processes so each worker opens the PDF only once
+        processes = min(cpu_count(), page_count)
+        step = -(-page_count // processes)
+        jobs = [
+            (file_path, start, min(start + step, page_count))
+            for start in range(0, page_count, step)
+        ]
+
+        pool = self._get_pdf_pool()
+        try:
+            results = list(pool.map(_extract_pages, jobs))
+        except BrokenProcessPool:
+            # A worker died (e.g. on a malformed PDF); start a new pool on
+            # the next call
+            with self._pdf_pool_lock:
+                if self._pdf_pool is pool:
+                    self._pdf_pool = None
+            raise
+
         transactions = []
+        for parsed in results:
+            transactions.extend(parsed)
 
-        with pdfplumber.open(file_path) as pdf:
-            for page in pdf.pages:
-                text = page.extract_text()
-                if text:
-                    # Try to extract table first
-                    tables = page.extract_tables()
-                    if tables:
-                        for table in tables:
-                            parsed = self._parse_table(table)
-                            transactions.extend(parsed)
-                    else:
-                        # Fallback to text extraction
-                        parsed = self._parse_text(text)
-                        transactions.extend(parsed)
+        return transactions
+
+    def _read_pymupdf_page(
+        self, page
+    ) -> Optional[Tuple[List[List[List]], Optional[str]]]:
+        """Extract the tables, or else the text, of a PyMuPDF page
+
+        Returns None when PyMuPDF finds neither tables nor text, so the
+        caller can retry the page with pdfplumber.
+        """
+        tables = page.find_tables().tables
+        if tables:
+            return [table.extract() for table in tables], None
+
+        text = page.get_text("text")
+        if not text or not text.strip():
+            return None
+
+        return [], text
+
+    def _read_pdfplumber_page(self, page) -> Tuple[List[List[List]], Optional[str]]:
+        """Extract the tables, or else the text, of a pdfplumber page"""
+        # Try to extract table first; only lay the text out when there is none
+        tables = page.extract_tables()
+        if tables:
+            return tables, None
+
+        return [], page.extract_text()
+
+    def _parse_page_content(
+        self, tables: List[List[List]], text: Optional[str]
+    ) -> List[Txn]:
+        """Extract transactions from the tables or text of a single page"""
+        transactions = []
+
+        if tables:
+            for table in tables:
+                parsed = self._parse_table(table)
+                transactions.extend(parsed)
+        elif text:
+            # Fallback to text extraction
+            parsed = self._parse_text(text)
+            transactions.extend(parsed)
 
         return transactions
 
-    def parse_csv(self, file_path: str) -> List[Dict]:
+    def parse_csv(self, file_path: str) -> List[Txn]:
         """Extract transactions from CSV bank statement"""
         transactions = []
 
         try:
-            df = pd.read_csv(file_path)
+            # Sniff the header first so unused columns are never parsed
+            columns = pd.read_csv(file_path, nrows=0).columns
 
             # Common column name patterns
             date_cols = [
                 col
-                for col in df.columns
+                for col in columns
                 if any(
                     keyword in col.lower()
                     for keyword in ["date", "posted", "transaction"]
@@ -50,7 +241,7 @@ class BankStatementParser:
             ]
             desc_cols = [
                 col
-                for col in df.columns
+                for col in columns
                 if any(
                     keyword in col.lower()
                     for keyword in [
@@ -64,42 +255,124 @@ class BankStatementParser:
             ]
             amount_cols = [
                 col
-                for col in df.columns
+                for col in columns
                 if any(
                     keyword in col.lower() for keyword in ["amount", "debit", "credit"]
                 )
             ]
 
-            for _, row in df.iterrows():
-                try:
-                    date_str = row[date_cols[0]] if date_cols else None
-                    description = str(row[desc_cols[0]]) if desc_cols else ""
-                    amount_str = str(row[amount_cols[0]]) if amount_cols else "0"
-
-                    # Parse date
-                    date = self._parse_date(date_str) if date_str else datetime.now()
-
-                    # Parse amount (handle negatives, remove currency symbols)
-                    amount = self._parse_amount(amount_str)
+            if not amount_cols:
+                return transactions
+
+            # Only read the columns we use; dates get C-level parsing
+            text_cols = {amount_cols[0]}
+            if desc_cols:
+                text_cols.add(desc_cols[0])
+            date_cols_to_parse = [col for col in date_cols[:1] if col not in text_cols]
+            df = pd.read_csv(
+                file_path,
+                usecols=list(text_cols.union(date_cols[:1])),
+                dtype={col: "string" for col in text_cols},
+                parse_dates=date_cols_to_parse,
+                engine="c",
+            )
 
-                    if amount != 0:
-                        transactions.append(
-                            {
-                                "date": date,
-                                "description": description.strip(),
-                                "amount": abs(amount),
-                                "merchant": self._extract_merchant(description),
-                            }
-                        )
-                except Exception:
-                    continue
+            try:
+                transactions = self._parse_csv_columns(
+                    df, date_cols, desc_cols, amount_cols
+                )
+            except Exception:
+                # Odd-shaped frames (e.g. duplicated column names)
+                transactions = self._parse_csv_rows(
+                    df, date_cols, desc_cols, amount_cols
+                )
 
         except Exception as e:
             print(f"Error parsing CSV: {e}")
 
         return transactions
 
-    def _parse_table(self, table: List[List]) -> List[Dict]:
+    def _parse_csv_columns(
+        self,
+        df: pd.DataFrame,
+        date_cols: List[str],
+        desc_cols: List[str],
+        amount_cols: List[str],
+    ) -> List[Txn]:
+        """Parse CSV transactions column-wise instead of row by row"""
+        # Parse amounts (handle negatives, remove currency symbols)
+        amounts = pd.to_numeric(
+            df[amount_cols[0]].astype(str).str.replace(r"[$€£,\s]", "", regex=True),
+            errors="coerce",
+        ).fillna(0)
+        mask = amounts != 0
+        amounts = amounts[mask].abs()
+
+        if desc_cols:
+            descriptions = df.loc[mask, desc_cols[0]].astype(str)
+        else:
+            descriptions = pd.Series("", index=amounts.index)
+
+        if date_cols:
+            raw_dates = df.loc[mask, date_cols[0]]
+            dates = pd.to_datetime(raw_dates, errors="coerce")
+            # Formats pandas could not infer go through dateutil one by one
+            missed = dates.isna() & raw_dates.notna()
+            dates = dates.astype(object)
+            dates[missed] = raw_dates[missed].map(self._parse_date)
+            dates = dates.where(raw_dates.notna(), None)
+        else:
+            dates = pd.Series(None, index=amounts.index, dtype=object)
+
+        return [
+            Txn(
+                date=date if date is not None else datetime.now(),
+                description=description.strip(),
+                amount=float(amount),
+                merchant=self._extract_merchant(description),
+            )
+            for date, description, amount in zip(dates, descriptions, amounts)
+        ]
+
+    def _parse_csv_rows(
+        self,
+        df: pd.DataFrame,
+        date_cols: List[str],
+        desc_cols: List[str],
+        amount_cols: List[str],
+    ) -> List[Txn]:
+        """Parse CSV transactions row by row"""
+        transactions = []
+        columns = list(df.columns)
+        date_idx = columns.index(date_cols[0]) if date_cols else None
+        desc_idx = columns.index(desc_cols[0]) if desc_cols else None
+        amount_idx = columns.index(amount_cols[0])
+
+        for row in df.itertuples(index=False, name=None):
+            try:
+                date_str = row[date_idx] if date_idx is not None else None
+                description = str(row[desc_idx]) if desc_idx is not None else ""
+                amount = self._parse_amount(str(row[amount_idx]))
+
+                if amount != 0:
+                    transactions.append(
+                        Txn(
+                            date=(
+                                self._parse_date(date_str)
+                                if date_str
+                                else datetime.now()
+                            ),
+                            description=description.strip(),
+                            amount=abs(amount),
+                            merchant=self._extract_merchant(description),
+                        )
+                    )
+            except Exception:
+                continue
+
+        return transactions
+
+    def _parse_table(self, table: List[List]) -> List[Txn]:
         """Parse transactions from table format"""
         transactions = []
 
@@ -130,84 +403,52 @@ class BankStatementParser:
                             transaction["amount"] = self._parse_amount(value)
 
                 if "description" in transaction and transaction.get("amount", 0) != 0:
-                    transaction["merchant"] = self._extract_merchant(
-                        transaction["description"]
+                    transactions.append(
+                        Txn(
+                            date=transaction.get("date") or datetime.now(),
+                            description=transaction["description"],
+                            amount=transaction["amount"],
+                            merchant=self._extract_merchant(transaction["description"]),
+                        )
                     )
-                    transactions.append(transaction)
             except Exception:
                 continue
 
         return transactions
 
-    def _parse_text(self, text: str) -> List[Dict]:
+    def _parse_text(self, text: str) -> List[Txn]:
         """Parse transactions from unstructured text"""
         transactions = []
-        lines = text.split("\n")
-
-        # Common patterns for transaction lines (including French dates)
-        date_pattern = (
-            r"\d{1,2}[.\s]+(janv|févr|mars|avr|mai|juin|juil|août|"
-            r"sept|oct|nov|déc)[.\s]+\d{2,4}|\d{1,2}[/-]\d{1,2}[/-]\d{2,4}"
-        )
-        amount_pattern = r"€?\s*\d+[.,]\d+"
-
-        # French month abbreviations (map to English for dateutil)
-        # Order matters: longer abbreviations first to avoid partial matches
-        month_map = {
-            "janv": "january",
-            "févr": "february",
-            "fév": "february",
-            "mars": "march",
-            "avr": "april",
-            "mai": "may",
-            "juin": "june",
-            "juil": "july",
-            "août": "august",
-            "sept": "september",
-            "oct": "october",
-            "nov": "november",
-            "déc": "december",
-        }
 
-        # Skip header lines
-        skip_keywords = [
-            "Relevé",
-            "Généré le",
-            "Transactions du compte",
-            "Date",
-            "Description",
-            "Argent sortant",
-            "Argent entrant",
-            "Solde",
-            "Résumé",
-            "COMPTE",
-            "TOTAL",
-            "Renvoyé",
-            "Page",
-        ]
+        line_starts = [0] + [m.end() for m in _NEWLINE_RE.finditer(text)]
+        # Scan the whole text once per pattern, then map hits back to lines
+        skipped_lines = {
+            bisect_right(line_starts, m.start()) - 1 for m in _SKIP_RE.finditer(text)
+        }
+        date_hits = {}
+        for m in _DATE_RE.finditer(text):
+            date_hits.setdefault(bisect_right(line_starts, m.start()) - 1, m)
+        amount_hits = {}
+        for m in _AMOUNT_RE.finditer(text):
+            amount_hits.setdefault(bisect_right(line_starts, m.start()) - 1, m)
 
         current_date = None
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-
+        for line_no in sorted(date_hits.keys() | amount_hits.keys()):
             # Skip header/summary lines
-            if any(kw in line for kw in skip_keywords):
+            if line_no in skipped_lines:
                 continue
 
             # Extract date (try French format first)
-            date_match = re.search(date_pattern, line, re.IGNORECASE)
+            date_match = date_hits.get(line_no)
             if date_match:
                 date_str = date_match.group()
                 try:
-                    # Try to parse French format (sort by length desc)
-                    sorted_months = sorted(month_map.items(), key=lambda x: -len(x[0]))
-                    for fr_month, en_month in sorted_months:
-                        if fr_month in date_str.lower():
-                            date_str_eng = date_str.lower().replace(fr_month, en_month)
-                            current_date = self._parse_date(date_str_eng)
-                            break
+                    # Try to parse French format
+                    date_str_eng, n_months = _FR_MONTH_RE.subn(
+                        lambda m: _MONTH_MAP[m.group()], date_str.lower()
+                    )
+                    if n_months:
+                        current_date = self._parse_date(date_str_eng)
                     else:
                         # Try normal format
                         current_date = self._parse_date(date_str)
@@ -215,7 +456,7 @@ class BankStatementParser:
                     pass
 
             # Extract amount with € symbol
-            amount_match = re.search(amount_pattern, line)
+            amount_match = amount_hits.get(line_no)
             if amount_match and current_date:
                 amount_str = (
                     amount_match.group().replace("€", "").replace(",", ".").strip()
@@ -224,32 +465,42 @@ class BankStatementParser:
                     amount = abs(float(amount_str))
                     if amount > 0.01:  # Filter out tiny amounts
                         # Get merchant name (usually before the amount)
-                        desc = line.split("€")[0].strip() if "€" in line else line
-                        # Clean up description
-                        desc = re.sub(r"\s+\d+[.,]\d+\s*$", "", desc).strip()
+                        desc = text[line_starts[line_no] : amount_match.start()].strip()
+                        if not desc:
+                            # The line starts with the amount: use what follows
+                            line_end = self._line_end(text, line_starts, line_no)
+                            desc = (
+                                text[amount_match.end() : line_end]
+                                .lstrip("€ \t")
+                                .rstrip()
+                            )
 
                         transactions.append(
-                            {
-                                "date": current_date,
-                                "description": desc,
-                                "amount": amount,
-                                "merchant": self._extract_merchant(desc),
-                            }
+                            Txn(
+                                date=current_date,
+                                description=desc,
+                                amount=amount,
+                                merchant=self._extract_merchant(desc),
+                            )
                         )
                 except ValueError:
                     continue
 
         return transactions
 
+    def _line_end(self, text: str, line_starts: List[int], line_no: int) -> int:
+        """Offset just past the given line (including its newline)"""
+        if line_no + 1 < len(line_starts):
+            return line_starts[line_no + 1]
+        return len(text)
+
     def _parse_date(self, date_str: str) -> datetime:
         """Parse various date formats"""
-        from dateutil import parser
-
         if isinstance(date_str, datetime):
             return date_str
 
         try:
-            return parser.parse(str(date_str))
+            return _cached_parse(str(date_str))
         except Exception:
             return datetime.now()
 
@@ -258,15 +509,8 @@ class BankStatementParser:
         if isinstance(amount_str, (int, float)):
             return float(amount_str)
 
-        # Remove currency symbols and commas
-        cleaned = (
-            str(amount_str)
-            .replace("$", "")
-            .replace("€", "")
-            .replace("£", "")
-            .replace(",", "")
-            .strip()
-        )
+        # Remove currency symbols, commas and blanks in one pass
+        cleaned = str(amount_str).translate(_AMOUNT_TRANS)
 
         try:
             return float(cleaned)
@@ -275,14 +519,49 @@ class BankStatementParser:
 
     def _extract_merchant(self, description: str) -> str:
         """Extract merchant name from transaction description"""
-        # Common patterns: "MERCHANT NAME", "Merchant Name", etc.
-        # Remove common prefixes
-        desc = description.upper()
-
-        # Remove transaction codes, card numbers, etc.
-        desc = re.sub(r"\d{4,}", "", desc)  # Remove long numbers
-        desc = re.sub(r"\s+", " ", desc).strip()
-
-        # Return first meaningful words (up to 3 words typically)
-        words = desc.split()[:3]
-        return " ".join(words) if words else description[:30]
+        return _merchant_core(description)
+
+
+def _extract_pages(args: Tuple[str, int, int]) -> List[Txn]:
+    """Parse a range of PDF pages (runs in a worker process)
+
+    A reader thread extracts the next pages while this thread parses the
+    current one. Only the reader thread touches the open documents.
+    """
+    file_path, start, stop = args
+    parser = BankStatementParser()
+    docs = {}
+
+    def read_page(page_index: int) -> Tuple[List[List[List]], Optional[str]]:
+        if HAS_PYMUPDF:
+            if "pymupdf" not in docs:
+                docs["pymupdf"] = pymupdf.open(file_path)
+            content = parser._read_pymupdf_page(docs["pymupdf"][page_index])
+            if content is not None:
+                return content
+
+        if "pdfplumber" not in docs:
+            docs["pdfplumber"] = pdfplumber.open(file_path)
+        return parser._read_pdfplumber_page(docs["pdfplumber"].pages[page_index])
+
+    transactions = []
+    try:
+        with ThreadPoolExecutor(max_workers=1) as reader:
+            pending = deque(
+                reader.submit(read_page, i)
+                for i in range(start, min(start + _PREFETCH_PAGES, stop))
+            )
+            next_page = start + len(pending)
+
+            while pending:
+                tables, text = pending.popleft().result()
+                if next_page < stop:
+                    pending.append(reader.submit(read_page, next_page))
+                    next_page += 1
+
+                transactions.extend(parser._parse_page_content(tables, text))
+    finally:
+        for doc in docs.values():
+            doc.close()
+
+    return transactions
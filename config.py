@@ -1,8 +1,10 @@
 import os
+from dataclasses import dataclass
 from typing import Optional
 
 
-class Config:
+@dataclass(frozen=True, slots=True)
+class _Config:
     # Groq API Configuration (Fast, free tier available)
     GROQ_API_KEY: Optional[str] = os.getenv("GROQ_API_KEY", "")
 
@@ -25,14 +27,30 @@ class Config:
     UPLOAD_DIR: str = "uploads"
     STATEMENTS_DIR: str = "uploads/statements"
     EMAILS_DIR: str = "uploads/emails"
+    BATCHES_DIR: str = "uploads/batches"
 
     # LLM Settings
     GROQ_MODEL_NAME: str = os.getenv("GROQ_MODEL_NAME", "llama-3.3-70b-versatile")
     OLLAMA_MODEL_NAME: str = os.getenv("OLLAMA_MODEL_NAME", "llama3.2")
     MODEL_NAME: str = "gpt-4-turbo-preview"  # OpenAI model
     TEMPERATURE: float = 0.3
+    # Per-request LLM timeout (seconds); rate-limit and connection errors
+    # are retried with exponential backoff by the provider clients
+    LLM_TIMEOUT: float = float(os.getenv("LLM_TIMEOUT", "30"))
+    LLM_MAX_RETRIES: int = int(os.getenv("LLM_MAX_RETRIES", "3"))
+    # Max LLM batch requests in flight at once
+    MAX_CONCURRENT_REQUESTS: int = int(os.getenv("MAX_CONCURRENT_REQUESTS", "10"))
+    # Groq requests and tokens per minute (free tier); 0 disables the limit
+    GROQ_RPM: int = int(os.getenv("GROQ_RPM", "30"))
+    GROQ_TPM: int = int(os.getenv("GROQ_TPM", "6000"))
+    # On-disk cache of LLM answers (used when diskcache is installed)
+    LLM_CACHE_DIR: str = os.getenv("LLM_CACHE_DIR", ".llm_cache")
+    LLM_CACHE_TTL: int = int(os.getenv("LLM_CACHE_TTL", str(30 * 86400)))
 
     # Use AI classification (can be slow with Ollama)
     USE_AI_CLASSIFICATION: bool = (
         os.getenv("USE_AI_CLASSIFICATION", "false").lower() == "true"
     )
+
+
+Config = _Config()
@@ -1,11 +1,57 @@
 import imaplib
 import email
 from email.header import decode_header
+from email.message import EmailMessage
+from email.parser import BytesParser
+from email.policy import default
 from bs4 import BeautifulSoup
 import re
 from datetime import datetime
-from typing import List, Dict, Optional
+from functools import lru_cache
+from typing import List, Optional
 from config import Config
+from transaction import Txn
+
+# Pattern: "charged $XX.XX", "payment of $XX.XX", etc.
+_CHARGE_PATTERNS = [
+    r"charged\s+[\$£€]?(\d+[.,]?\d*)",
+    r"payment\s+of\s+[\$£€]?(\d+[.,]?\d*)",
+    r"[\$£€](\d+[.,]?\d*)\s+(?:was|has been)",
+    r"amount[:\s]+[\$£€]?(\d+[.,]?\d*)",
+]
+# Charge patterns first, then any amount as the last alternative, so one
+# scan finds both; the matched group number tells which one hit
+_AMOUNT_SCAN_RE = re.compile(
+    "|".join(_CHARGE_PATTERNS + [r"[\$£€]?\s*(\d+[.,]?\d*)"]), re.IGNORECASE
+)
+
+# Common email prefixes in front of the merchant name
+_MERCHANT_STRIP_RES = [
+    re.compile(p, re.IGNORECASE)
+    for p in [
+        r"RECEIPT\s+FROM\s+",
+        r"PAYMENT\s+(?:RECEIPT|CONFIRMATION)\s+FROM\s+",
+        r"CHARGE\s+(?:FROM|AT)\s+",
+    ]
+]
+
+# Body words that can matter for the merchant name
+_MERCHANT_BODY_WORDS = 64
+
+
+@lru_cache(maxsize=8192)
+def _email_merchant_core(subject: str, body: str) -> str:
+    """Merchant name for an email subject and (start of the) body"""
+    # Common patterns: "Receipt from [Merchant]", "[Merchant] - Payment", etc.
+    text = f"{subject} {body}".upper()
+
+    # Remove common email prefixes
+    for pattern in _MERCHANT_STRIP_RES:
+        text = pattern.sub("", text)
+
+    # Extract first meaningful words (likely merchant name)
+    words = text.split()[:3]
+    return " ".join(words) if words else subject[:30]
 
 
 class EmailParser:
@@ -39,7 +85,7 @@ class EmailParser:
         folder: str = "INBOX",
         sender_filter: Optional[str] = None,
         limit: int = 100,
-    ) -> List[Dict]:
+    ) -> List[Txn]:
         """Parse emails from IMAP server"""
         if not self.imap:
             if not self.connect():
@@ -62,12 +108,25 @@ class EmailParser:
 
             email_ids = messages[0].split()[-limit:]
 
-            for email_id in reversed(email_ids):  # Start with newest
-                status, msg_data = self.imap.fetch(email_id, "(RFC822)")
+            if not email_ids:
+                return []
+
+            # Fetch all messages in one round-trip; PEEK leaves them unread
+            id_set = b",".join(email_ids)
+            status, msg_data = self.imap.fetch(id_set, "(BODY.PEEK[])")
 
-                if status == "OK":
-                    email_body = msg_data[0][1]
-                    email_message = email.message_from_bytes(email_body)
+            if status == "OK":
+                # Message parts come back as (header, body) tuples separated
+                # by closing-paren bytes
+                email_bodies = [part[1] for part in msg_data if isinstance(part, tuple)]
+                del msg_data
+
+                # Pop from the end: newest first, and each raw message can be
+                # freed as soon as it has been parsed
+                while email_bodies:
+                    email_message = email.message_from_bytes(
+                        email_bodies.pop(), policy=default
+                    )
 
                     parsed = self._parse_email_message(email_message)
                     if parsed:
@@ -81,13 +140,13 @@ class EmailParser:
 
         return transactions
 
-    def parse_email_file(self, file_path: str) -> List[Dict]:
+    def parse_email_file(self, file_path: str) -> List[Txn]:
         """Parse a single email file"""
         with open(file_path, "rb") as f:
-            email_message = email.message_from_bytes(f.read())
-            return self._parse_email_message(email_message)
+            email_message = BytesParser(policy=default).parse(f)
+        return self._parse_email_message(email_message)
 
-    def _parse_email_message(self, email_message: email.message.Message) -> List[Dict]:
+    def _parse_email_message(self, email_message: EmailMessage) -> List[Txn]:
         """Extract transaction info from email message"""
         transactions = []
 
@@ -95,9 +154,6 @@ class EmailParser:
         subject = self._decode_header(email_message["Subject"])
         body = self._get_email_body(email_message)
 
-        # Common patterns for transaction emails
-        amount_pattern = r"[\$£€]?\s*(\d+[.,]?\d*)"
-
         # Extract date from email
         email_date = email_message.get("Date")
         parsed_date = datetime.now()
@@ -112,60 +168,47 @@ class EmailParser:
         # Look for transaction patterns in subject and body
         text_to_parse = f"{subject}\n{body}"
 
-        # Try to extract structured transaction info
-        # Pattern: "charged $XX.XX", "payment of $XX.XX", etc.
-        charge_patterns = [
-            r"charged\s+[\$£€]?(\d+[.,]?\d*)",
-            r"payment\s+of\s+[\$£€]?(\d+[.,]?\d*)",
-            r"[\$£€](\d+[.,]?\d*)\s+(?:was|has been)",
-            r"amount[:\s]+[\$£€]?(\d+[.,]?\d*)",
-        ]
-
+        # Extract structured transaction info, and remember the first plain
+        # amount in case no charge pattern matches
         amounts_found = []
-        for pattern in charge_patterns:
-            matches = re.finditer(pattern, text_to_parse, re.IGNORECASE)
-            for match in matches:
-                try:
-                    amount = float(match.group(1).replace(",", ""))
-                    if amount > 0.01:
-                        amounts_found.append((amount, match.start()))
-                except:
-                    continue
+        fallback_amount = None
+        for match in _AMOUNT_SCAN_RE.finditer(text_to_parse):
+            try:
+                amount = float(match.group(match.lastindex).replace(",", ""))
+            except ValueError:
+                continue
+
+            if match.lastindex <= len(_CHARGE_PATTERNS):
+                if amount > 0.01:
+                    amounts_found.append(amount)
+            elif fallback_amount is None and 1.0 <= amount <= 10000.0:
+                # Reasonable range
+                fallback_amount = amount
 
         # Extract merchant from subject or body
         merchant = self._extract_merchant_from_email(subject, body)
 
         # Create transaction entries
         if amounts_found:
-            for amount, _ in amounts_found:
+            for amount in amounts_found:
                 transactions.append(
-                    {
-                        "date": parsed_date,
-                        "description": f"{merchant} - {subject}",
-                        "amount": amount,
-                        "merchant": merchant,
-                    }
+                    Txn(
+                        date=parsed_date,
+                        description=f"{merchant} - {subject}",
+                        amount=amount,
+                        merchant=merchant,
+                    )
+                )
+        elif merchant and fallback_amount is not None:
+            # No charge found but merchant identified
+            transactions.append(
+                Txn(
+                    date=parsed_date,
+                    description=f"{merchant} - {subject}",
+                    amount=fallback_amount,
+                    merchant=merchant,
                 )
-        elif (
-            amounts_found == [] and merchant
-        ):  # No amount found but merchant identified
-            # Try to find amount in body more aggressively
-            amount_matches = re.finditer(amount_pattern, text_to_parse)
-            for match in amount_matches:
-                try:
-                    amount = float(match.group(1).replace(",", ""))
-                    if 1.0 <= amount <= 10000.0:  # Reasonable range
-                        transactions.append(
-                            {
-                                "date": parsed_date,
-                                "description": f"{merchant} - {subject}",
-                                "amount": amount,
-                                "merchant": merchant,
-                            }
-                        )
-                        break
-                except:
-                    continue
+            )
 
         return transactions
 
@@ -185,59 +228,37 @@ class EmailParser:
 
         return decoded_string
 
-    def _get_email_body(self, email_message: email.message.Message) -> str:
+    def _get_email_body(self, email_message: EmailMessage) -> str:
         """Extract email body text"""
-        body = ""
-
-        if email_message.is_multipart():
-            for part in email_message.walk():
-                content_type = part.get_content_type()
-                content_disposition = str(part.get("Content-Disposition"))
-
-                if (
-                    content_type == "text/plain"
-                    and "attachment" not in content_disposition
-                ):
-                    try:
-                        body_bytes = part.get_payload(decode=True)
-                        charset = part.get_content_charset() or "utf-8"
-                        body += body_bytes.decode(charset, errors="ignore")
-                    except Exception:
-                        pass
-                elif content_type == "text/html":
-                    try:
-                        html_body = part.get_payload(decode=True)
-                        charset = part.get_content_charset() or "utf-8"
-                        html_content = html_body.decode(charset, errors="ignore")
-                        soup = BeautifulSoup(html_content, "html.parser")
-                        body += soup.get_text()
-                    except Exception:
-                        pass
-        else:
+        # Prefer plain text; HTML is only parsed when there is no plain part
+        part = email_message.get_body(preferencelist=("plain", "html"))
+        if part is None:
+            return ""
+
+        try:
+            content = part.get_content()
+        except Exception:
             try:
-                body_bytes = email_message.get_payload(decode=True)
-                charset = email_message.get_content_charset() or "utf-8"
-                body = body_bytes.decode(charset, errors="ignore")
+                content = part.get_payload(decode=True).decode("utf-8", errors="ignore")
             except Exception:
-                pass
+                return ""
+
+        if part.get_content_subtype() == "html":
+            try:
+                content = BeautifulSoup(content, "lxml").get_text()
+            except Exception:
+                return ""
 
-        return body
+        return content
 
     def _extract_merchant_from_email(self, subject: str, body: str) -> str:
         """Extract merchant name from email subject or body"""
-        # Common patterns: "Receipt from [Merchant]", "[Merchant] - Payment", etc.
-        text = f"{subject} {body}".upper()
-
-        # Remove common email prefixes
-        patterns_to_remove = [
-            r"RECEIPT\s+FROM\s+",
-            r"PAYMENT\s+(?:RECEIPT|CONFIRMATION)\s+FROM\s+",
-            r"CHARGE\s+(?:FROM|AT)\s+",
-        ]
-
-        for pattern in patterns_to_remove:
-            text = re.sub(pattern, "", text, flags=re.IGNORECASE)
-
-        # Extract first meaningful words (likely merchant name)
-        words = text.split()[:3]
-        return " ".join(words) if words else subject[:30]
+        # Only the first words matter, so key the cache on the leading words
+        # of the body to bound its memory; the margin covers words removed
+        # with the stripped prefixes
+        words = body.split(None, _MERCHANT_BODY_WORDS)
+        head = " ".join(words[:_MERCHANT_BODY_WORDS])
+        # Keep a separator after the last word, which a prefix may end with
+        if len(words) > _MERCHANT_BODY_WORDS or body[-1:].isspace():
+            head += " "
+        return _email_merchant_core(subject, head)
@@ -1,21 +1,228 @@
-from typing import List, Dict
-from collections import defaultdict
+import asyncio
+import hashlib
+import json
+import re
+import numpy as np
+from typing import List, Dict, Optional, Tuple
+from collections import Counter, defaultdict
+from pydantic import BaseModel, ConfigDict
 from config import Config
+from transaction import Txn
 
 try:
-    from openai import OpenAI
+    from openai import AsyncOpenAI
 
     HAS_OPENAI = True
 except ImportError:
     HAS_OPENAI = False
 
 try:
-    from groq import Groq
+    from groq import AsyncGroq
 
     HAS_GROQ = True
 except ImportError:
     HAS_GROQ = False
 
+try:
+    from aiolimiter import AsyncLimiter
+
+    HAS_AIOLIMITER = True
+except ImportError:
+    HAS_AIOLIMITER = False
+
+try:
+    import diskcache
+
+    HAS_DISKCACHE = True
+except ImportError:
+    HAS_DISKCACHE = False
+
+# Merchant normalization: patterns like "21 DÉC.", "8 JUIL.", leading month
+# abbreviations and any remaining numbers
+_DATE_RE = re.compile(r"\d+\s+[A-ZÀÂÆÇÉÈÊËÎÏÔŒÙÛÜŸ]+\.?\s*")
+_ABBREV_RE = re.compile(r"^[A-ZÀÂÆÇÉÈÊËÎÏÔŒÙÛÜŸ]+\.\s*")
+_DIGITS_RE = re.compile(r"\d+")
+
+
+def _normalize_merchant(merchant: str) -> str:
+    """Normalize a merchant name by removing dates and numbers"""
+    merchant = _DATE_RE.sub("", merchant.upper())
+    merchant = _ABBREV_RE.sub("", merchant)
+    return _DIGITS_RE.sub("", merchant).strip()
+
+
+# Common membership keywords
+_MEMBERSHIP_KEYWORDS = [
+    "SUBSCRIPTION",
+    "MEMBERSHIP",
+    "MONTHLY",
+    "ANNUAL",
+    "RECURRING",
+    "NETFLIX",
+    "SPOTIFY",
+    "AMAZON PRIME",
+    "ADOBE",
+    "MICROSOFT 365",
+    "MICROSOFT",
+    "CURSOR",
+    "APPLE",
+    "GYM",
+    "FITNESS",
+    "GOLF",
+    "TENNIS",
+    "YOGI",
+    "PILATES",
+    "OFFICE",
+    "SOFTWARE",
+    "SaaS",
+    "CLOUD",
+    "NEWS",
+    "TIMES",
+    "JOURNAL",
+    "MAGAZINE",
+]
+# Membership type keywords, in priority order
+_TYPE_KEYWORDS = {
+    "Sport": ["GYM", "FITNESS", "GOLF", "TENNIS", "YOGI", "PILATES", "SPORT"],
+    "Streaming": ["NETFLIX", "SPOTIFY", "DISNEY", "HULU", "PRIME VIDEO", "STREAMING"],
+    "Software": [
+        "ADOBE",
+        "MICROSOFT",
+        "OFFICE",
+        "SOFTWARE",
+        "SaaS",
+        "CURSOR",
+        "APPLE",
+    ],
+    "News": ["NEWS", "TIMES", "JOURNAL", "MAGAZINE"],
+}
+# Frequency keywords, in priority order
+_FREQUENCY_KEYWORDS = {
+    "Monthly": ["MONTHLY", "MONTH"],
+    "Yearly": ["YEARLY", "ANNUAL", "YEAR"],
+    "Weekly": ["WEEKLY", "WEEK"],
+}
+# Payment amount to monthly cost as (multiplier, divisor); dividing rather
+# than multiplying by 1/12 etc. keeps the rounded cents exact. Monthly and
+# unknown frequencies are kept as is
+_FREQ_MULT = {
+    "Yearly": (1, 12),
+    "Weekly": (4.33, 1),
+    "Quarterly": (1, 3),
+    "Bi-annual": (1, 6),
+}
+
+_MEMBERSHIP = "membership"
+
+
+def _build_keyword_tags() -> Dict[str, set]:
+    """Map each keyword to the tags (membership, type, frequency) it implies"""
+    tags = defaultdict(set)
+    for keyword in _MEMBERSHIP_KEYWORDS:
+        tags[keyword].add(_MEMBERSHIP)
+    for groups in (_TYPE_KEYWORDS, _FREQUENCY_KEYWORDS):
+        for tag, keywords in groups.items():
+            for keyword in keywords:
+                tags[keyword].add(tag)
+
+    # The scan reports one keyword per position (the longest), so a keyword
+    # also carries the tags of the shorter keywords it starts with
+    return {
+        keyword: set().union(
+            *(own for other, own in tags.items() if keyword.startswith(other))
+        )
+        for keyword in tags
+    }
+
+
+_KEYWORD_TAGS = _build_keyword_tags()
+# Lookahead so overlapping keywords ("AMAZON PRIME VIDEO") are all found
+_KEYWORD_RE = re.compile(
+    "(?=("
+    + "|".join(re.escape(k) for k in sorted(_KEYWORD_TAGS, key=len, reverse=True))
+    + "))"
+)
+
+
+# The models are lenient on purpose: Groq only gets JSON mode, so answers
+# with extra keys or missing null fields must still validate. The strict
+# form is only sent as the schema for providers that enforce it
+class Classification(BaseModel):
+    """LLM verdict for one transaction"""
+
+    model_config = ConfigDict(extra="ignore")
+
+    is_membership: bool
+    membership_type: Optional[str] = None
+    frequency: Optional[str] = None
+    category: str
+
+
+class ClassificationList(BaseModel):
+    """LLM answer for a batch, one item per transaction in input order"""
+
+    model_config = ConfigDict(extra="ignore")
+
+    items: List[Classification]
+
+
+def _strict_schema(model: type) -> Dict:
+    """JSON schema of model in the form strict structured outputs require
+
+    Every field required (nullable ones may still be null) and no extra keys.
+    """
+    schema = model.model_json_schema()
+    for obj in [schema, *schema.get("$defs", {}).values()]:
+        obj["required"] = list(obj["properties"])
+        obj["additionalProperties"] = False
+        for prop in obj["properties"].values():
+            prop.pop("default", None)
+    return schema
+
+
+# Constrains the LLM answer to ClassificationList, so it can't wrap the JSON
+# in prose or drift from the fields
+_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "classifications",
+        "schema": _strict_schema(ClassificationList),
+        "strict": True,
+    },
+}
+
+# OpenAI models from before structured outputs; they reject json_schema
+_PRE_JSON_SCHEMA_MODELS = ("gpt-3.5", "gpt-4-", "gpt-4o-2024-05-13")
+
+_SYSTEM_MSG = (
+    "You are a financial transaction classifier. Analyze "
+    "transactions and classify them accurately. Always respond "
+    "with valid JSON only."
+)
+
+# Transactions per LLM request
+_BATCH_SIZE = 20
+
+# Batch API job states after which no more results will arrive
+_BATCH_ENDED_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def _estimate_tokens(params: Dict) -> int:
+    """Rough token count of a request
+
+    About 4 characters per prompt token, plus the completion budget.
+    """
+    chars = sum(len(m["content"]) for m in params["messages"])
+    return chars // 4 + params["max_tokens"]
+
+
+def _split_batches(transactions: List[Txn]) -> List[List[Txn]]:
+    """Split transactions into LLM request sized batches"""
+    return [
+        transactions[i : i + _BATCH_SIZE]
+        for i in range(0, len(transactions), _BATCH_SIZE)
+    ]
+
 
 class MembershipClassifier:
     """Use LLM to classify transactions as membership vs one-off payments"""
@@ -24,102 +231,261 @@ class MembershipClassifier:
         self.client = None
         self.model_name = None
         self.provider = None
+        # Whether the provider offers the asynchronous Batch API
+        self.supports_batch_api = False
+        # Bounds how many batches are in flight with the provider at once
+        self._sem = asyncio.Semaphore(Config.MAX_CONCURRENT_REQUESTS)
+        # Provider requests/tokens per minute budgets (Groq only)
+        self._rpm_limiter = None
+        self._tpm_limiter = None
+        # LLM requests in progress by prompt hash
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # Parsed LLM answers by prompt, so re-uploads skip the provider; set
+        # up below once there is an LLM to cache
+        self._cache = None
 
         # Priority: Groq > Ollama > OpenAI
         if HAS_GROQ and Config.GROQ_API_KEY:
-            self.client = Groq(api_key=Config.GROQ_API_KEY)
+            self.client = AsyncGroq(
+                api_key=Config.GROQ_API_KEY,
+                timeout=Config.LLM_TIMEOUT,
+                max_retries=Config.LLM_MAX_RETRIES,
+            )
             self.model_name = Config.GROQ_MODEL_NAME
             self.provider = "Groq AI"
+            self.supports_batch_api = True
+            if HAS_AIOLIMITER and Config.GROQ_RPM:
+                self._rpm_limiter = AsyncLimiter(Config.GROQ_RPM, 60)
+            if HAS_AIOLIMITER and Config.GROQ_TPM:
+                self._tpm_limiter = AsyncLimiter(Config.GROQ_TPM, 60)
         # Try Ollama (free, runs locally)
         elif Config.OLLAMA_BASE_URL:
-            self.client = OpenAI(
+            self.client = AsyncOpenAI(
                 base_url=Config.OLLAMA_BASE_URL,
                 api_key="ollama",  # Not needed, but OpenAI client requires it
+                timeout=Config.LLM_TIMEOUT,
+                max_retries=Config.LLM_MAX_RETRIES,
             )
             self.model_name = Config.OLLAMA_MODEL_NAME
             self.provider = "Ollama AI"
         # Fallback to OpenAI if available
         elif HAS_OPENAI and Config.OPENAI_API_KEY:
-            self.client = OpenAI(api_key=Config.OPENAI_API_KEY)
+            self.client = AsyncOpenAI(
+                api_key=Config.OPENAI_API_KEY,
+                timeout=Config.LLM_TIMEOUT,
+                max_retries=Config.LLM_MAX_RETRIES,
+            )
             self.model_name = Config.MODEL_NAME
             self.provider = "OpenAI GPT"
+            self.supports_batch_api = True
+
+        if self.client and Config.USE_AI_CLASSIFICATION and HAS_DISKCACHE:
+            self._cache = diskcache.Cache(Config.LLM_CACHE_DIR)
 
-    def classify_transactions(self, transactions: List[Dict]) -> List[Dict]:
+    async def classify_transactions(self, transactions: List[Txn]) -> List[Txn]:
         """Classify transactions and return ONLY memberships"""
+        candidates, context = self._prepare_candidates(transactions)
+
         if not self.client or not Config.USE_AI_CLASSIFICATION:
             print(
                 "Using rule-based classification "
                 "(set USE_AI_CLASSIFICATION=true for AI)"
             )
-            classified = self._rule_based_classify(transactions)
+            classified = self._rule_based_classify(candidates)
         else:
-            # Process in batches to avoid rate limits
-            batch_size = 20
-            classified = []
-
-            for i in range(0, len(transactions), batch_size):
-                batch = transactions[i : i + batch_size]
-                classified_batch = self._classify_batch(
-                    batch, all_transactions=transactions
+            # Process in batches to avoid rate limits; batches run concurrently
+            results = await asyncio.gather(
+                *(
+                    self._classify_batch(batch, context)
+                    for batch in _split_batches(candidates)
+                )
+            )
+            classified = [t for batch in results for t in batch]
+
+        return self._finish_classification(classified)
+
+    async def classify_transactions_batch_api(
+        self, transactions: List[Txn]
+    ) -> Optional[str]:
+        """Submit transactions to the provider Batch API and return the job id
+
+        Results come back within 24h at half the token price; collect them
+        with collect_batch_results using the same transactions. Returns None
+        without submitting a job when no transaction needs the LLM.
+        """
+        if not self.supports_batch_api:
+            raise ValueError(f"{self.provider or 'Rule-based'} has no Batch API")
+
+        candidates, context = self._prepare_candidates(transactions)
+        if not candidates:
+            # Providers reject an empty batch file
+            return None
+
+        lines = []
+        for i, batch in enumerate(_split_batches(candidates)):
+            prompt = self._build_prompt(batch, context)
+            lines.append(
+                json.dumps(
+                    {
+                        "custom_id": f"b{i}",
+                        "method": "POST",
+                        "url": "/v1/chat/completions",
+                        "body": self._request_params(prompt, len(batch)),
+                    }
                 )
-                classified.extend(classified_batch)
+            )
 
+        batch_file = await self.client.files.create(
+            file=("batch.jsonl", "\n".join(lines).encode()), purpose="batch"
+        )
+        job = await self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        return job.id
+
+    async def collect_batch_results(
+        self, batch_id: str, transactions: List[Txn]
+    ) -> Tuple[str, Optional[List[Txn]]]:
+        """Status of a Batch API job and, once it has ended, the memberships
+
+        Batches without an answer (failed or expired job) fall back to the
+        rule-based classifier.
+        """
+        job = await self.client.batches.retrieve(batch_id)
+        if job.status not in _BATCH_ENDED_STATUSES:
+            return job.status, None
+
+        contents = {}
+        if job.output_file_id:
+            output = await self.client.files.content(job.output_file_id)
+            text = output.text
+            if callable(text):
+                # Groq returns a raw response with an async text()
+                text = await text()
+            for line in text.splitlines():
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                body = (item.get("response") or {}).get("body") or {}
+                if body.get("choices"):
+                    contents[item["custom_id"]] = body["choices"][0]["message"][
+                        "content"
+                    ]
+
+        candidates, context = self._prepare_candidates(transactions)
+        classified = []
+        for i, batch in enumerate(_split_batches(candidates)):
+            classifications = None
+            content = contents.get(f"b{i}")
+            if content is not None:
+                try:
+                    classifications = self._parse_classifications(content)
+                except Exception as e:
+                    print(f"Error in LLM classification: {e}")
+
+            if classifications is None:
+                classified.extend(self._rule_based_classify(batch))
+                continue
+
+            if self._cache is not None:
+                prompt = self._build_prompt(batch, context)
+                self._cache.set(
+                    self._cache_key(prompt),
+                    classifications,
+                    expire=Config.LLM_CACHE_TTL,
+                )
+            classified.extend(self._merge_classifications(batch, classifications))
+
+        return job.status, self._finish_classification(classified)
+
+    def _prepare_candidates(self, transactions: List[Txn]) -> Tuple[List[Txn], str]:
+        """Transactions worth classifying and the merchant frequency context"""
+        # Normalize each merchant once and count occurrences across all
+        # transactions
+        for t in transactions:
+            t.norm_merchant = _normalize_merchant(t.merchant)
+        merchant_counts = Counter(t.norm_merchant for t in transactions)
+
+        # A merchant seen only once can never be kept as a membership (see
+        # _filter_one_time_payments), so don't spend a classification on it
+        candidates = []
+        for t in transactions:
+            if merchant_counts[t.norm_merchant] >= 2:
+                candidates.append(t)
+            else:
+                t.is_membership = False
+                t.membership_type = None
+                t.frequency = None
+
+        context = f"\nMerchant frequency across ALL {len(transactions)} transactions:\n"
+        named_counts = [(m, c) for m, c in merchant_counts.most_common() if m]
+        for merchant, count in named_counts[:10]:
+            context += f"- {merchant}: {count} occurrence(s)\n"
+
+        return candidates, context
+
+    def _finish_classification(self, classified: List[Txn]) -> List[Txn]:
+        """Filter classified transactions down to priced memberships"""
         # Post-process: use frequency analysis to filter out one-time payments
         classified = self._filter_one_time_payments(classified)
 
         # Return ONLY memberships (filter out non-memberships)
-        memberships_only = [t for t in classified if t.get("is_membership")]
+        memberships_only = [t for t in classified if t.is_membership]
 
         # Add monthly cost estimation
-        memberships_only = self._add_monthly_costs(memberships_only)
-
-        return memberships_only
-
-    def _classify_batch(
-        self, transactions: List[Dict], all_transactions: List[Dict] = None
-    ) -> List[Dict]:
-        """Classify a batch of transactions using LLM"""
-        import re
-
-        # If all_transactions provided, add global context
-        if all_transactions:
-            # Count occurrences of each merchant across all transactions
-            merchant_counts = {}
-            for t in all_transactions:
-                merchant = t.get("merchant", "").upper()
-                # Normalize merchant name
-                date_pattern = r"\d+\s+[A-ZÀÂÆÇÉÈÊËÎÏÔŒÙÛÜŸ]+\.?\s*"
-                merchant_clean = re.sub(date_pattern, "", merchant)
-                abbrev_pattern = r"^[A-ZÀÂÆÇÉÈÊËÎÏÔŒÙÛÜŸ]+\.\s*"
-                merchant_clean = re.sub(abbrev_pattern, "", merchant_clean)
-                merchant_clean = re.sub(r"\d+", "", merchant_clean).strip()
-                if merchant_clean:
-                    merchant_counts[merchant_clean] = (
-                        merchant_counts.get(merchant_clean, 0) + 1
+        return self._add_monthly_costs(memberships_only)
+
+    async def _classify_batch(
+        self, transactions: List[Txn], context: str = ""
+    ) -> List[Txn]:
+        """Classify a batch of transactions using LLM
+
+        context is the merchant frequency summary across all transactions.
+        """
+        prompt = self._build_prompt(transactions, context)
+        cache_key = self._cache_key(prompt)
+
+        try:
+            classifications = None
+            if self._cache is not None:
+                classifications = self._cache.get(cache_key)
+
+            if classifications is None:
+                # Concurrent batches with the same prompt (e.g. the same
+                # statement uploaded twice) share a single request
+                request = self._inflight.get(cache_key)
+                if request is None:
+                    request = asyncio.ensure_future(
+                        self._request_classifications(prompt, len(transactions))
                     )
+                    self._inflight[cache_key] = request
+                    request.add_done_callback(
+                        lambda _: self._inflight.pop(cache_key, None)
+                    )
+                classifications = await asyncio.shield(request)
 
-            context = (
-                f"\nMerchant frequency across ALL {len(all_transactions)} "
-                f"transactions:\n"
-            )
-            sorted_merchants = sorted(merchant_counts.items(), key=lambda x: -x[1])[:10]
-            for merchant, count in sorted_merchants:
-                context += f"- {merchant}: {count} occurrence(s)\n"
-        else:
-            context = ""
+            return self._merge_classifications(transactions, classifications)
+
+        except Exception as e:
+            print(f"Error in LLM classification: {e}")
+            return self._rule_based_classify(transactions)
 
+    def _build_prompt(self, transactions: List[Txn], context: str) -> str:
+        """LLM prompt for a batch of transactions"""
         # Prepare prompt with context
         transaction_list = "\n".join(
             [
-                f"- {t.get('merchant', 'Unknown')}: "
-                f"${t['amount']:.2f} on "
-                f"{t['date'].strftime('%Y-%m-%d')} "
-                f"({t.get('description', '')[:50]})"
+                f"- {t.merchant}: "
+                f"${t.amount:.2f} on "
+                f"{t.date.strftime('%Y-%m-%d')} "
+                f"({t.description[:50]})"
                 for t in transactions
             ]
         )
 
-        prompt = (
+        return (
             "Identify ONLY recurring membership/subscription payments from "
             "the transactions below.\n\n"
             f"{context}"
@@ -129,149 +495,132 @@ class MembershipClassifier:
             "- frequency: Monthly/Weekly/Yearly based on date gaps\n"
             "- category: Clean merchant name (remove dates)\n\n"
             f"Transactions:\n{transaction_list}\n\n"
-            "Return JSON array matching input order:\n"
-            '[{"is_membership": boolean, "membership_type": string|null, '
-            '"frequency": string|null, "category": string}]\n'
+            "Return a JSON object with one item per transaction, in input "
+            "order:\n"
+            '{"items": [{"is_membership": boolean, "membership_type": '
+            'string|null, "frequency": string|null, "category": string}]}\n'
         )
 
-        try:
-            system_msg = (
-                "You are a financial transaction classifier. Analyze "
-                "transactions and classify them accurately. Always respond "
-                "with valid JSON only."
-            )
-            params = {
-                "model": self.model_name,
-                "messages": [
-                    {"role": "system", "content": system_msg},
-                    {"role": "user", "content": prompt},
-                ],
-                "temperature": Config.TEMPERATURE,
-            }
-
-            # Only add response_format for OpenAI API (not Groq/Ollama)
-            if HAS_OPENAI and Config.OPENAI_API_KEY and not HAS_GROQ:
-                params["response_format"] = {"type": "json_object"}
-
-            response = self.client.chat.completions.create(**params)
-
-            # Parse response
-            content = response.choices[0].message.content
-
-            # Try to extract JSON array
-            import json
-            import re
-
-            # If wrapped in json_object, extract the array
-            try:
-                result = json.loads(content)
-                if isinstance(result, dict) and "transactions" in result:
-                    classifications = result["transactions"]
-                elif isinstance(result, list):
-                    classifications = result
-                else:
-                    # Try to find array in the response
-                    array_match = re.search(r"\[.*\]", content, re.DOTALL)
-                    if array_match:
-                        classifications = json.loads(array_match.group())
-                    else:
-                        classifications = [result]
-            except Exception:
-                # Fallback: try to extract as list directly
-                array_match = re.search(r"\[.*\]", content, re.DOTALL)
-                if array_match:
-                    classifications = json.loads(array_match.group())
-                else:
-                    return self._rule_based_classify(transactions)
-
-            # Merge classifications with transactions
-            for i, transaction in enumerate(transactions):
-                if i < len(classifications):
-                    classification = classifications[i]
-                    transaction["is_membership"] = classification.get(
-                        "is_membership", False
-                    )
-                    transaction["membership_type"] = classification.get(
-                        "membership_type"
-                    )
-                    transaction["frequency"] = classification.get("frequency")
-                    transaction["category"] = classification.get(
-                        "category", transaction.get("merchant", "Unknown")
-                    )
-                else:
-                    # Fallback for missing classifications
-                    transaction.update(self._classify_single(transaction))
+    def _cache_key(self, prompt: str) -> str:
+        """Cache key for the answer to a prompt from the current model"""
+        return hashlib.sha256(
+            f"{self.model_name}\n{_SYSTEM_MSG}\n{prompt}".encode()
+        ).hexdigest()
+
+    def _request_params(self, prompt: str, count: int) -> Dict:
+        """Chat completion parameters for a prompt covering count transactions"""
+        params = {
+            "model": self.model_name,
+            "messages": [
+                {"role": "system", "content": _SYSTEM_MSG},
+                {"role": "user", "content": prompt},
+            ],
+            "temperature": Config.TEMPERATURE,
+            # Room for one JSON object per transaction, so the array is
+            # never cut off mid-way
+            "max_tokens": 64 * count + 128,
+        }
 
-            return transactions
+        if (
+            self.provider == "Groq AI"
+            or self.model_name == "gpt-4"
+            or self.model_name.startswith(_PRE_JSON_SCHEMA_MODELS)
+        ):
+            # Groq enforces schemas on a few models only and older OpenAI
+            # models not at all; JSON mode works on all of them and the
+            # answer is still validated against the schema
+            params["response_format"] = {"type": "json_object"}
+        else:
+            params["response_format"] = _RESPONSE_FORMAT
 
-        except Exception as e:
-            print(f"Error in LLM classification: {e}")
-            return self._rule_based_classify(transactions)
+        return params
+
+    async def _request_classifications(self, prompt: str, count: int) -> List[Dict]:
+        """Ask the LLM to classify count transactions and cache the answer"""
+        params = self._request_params(prompt, count)
+
+        # Wait for room in the per-minute budgets instead of bursting into
+        # rate limit errors
+        if self._rpm_limiter is not None:
+            await self._rpm_limiter.acquire()
+        if self._tpm_limiter is not None:
+            tokens = _estimate_tokens(params)
+            await self._tpm_limiter.acquire(min(tokens, self._tpm_limiter.max_rate))
+
+        async with self._sem:
+            response = await self.client.chat.completions.create(**params)
 
-    def _rule_based_classify(self, transactions: List[Dict]) -> List[Dict]:
+        # Parse response
+        classifications = self._parse_classifications(
+            response.choices[0].message.content
+        )
+        if self._cache is not None:
+            self._cache.set(
+                self._cache_key(prompt), classifications, expire=Config.LLM_CACHE_TTL
+            )
+        return classifications
+
+    def _parse_classifications(self, content: str) -> List[Dict]:
+        """Validate an LLM answer and return its classifications"""
+        answer = ClassificationList.model_validate_json(content)
+        return [item.model_dump() for item in answer.items]
+
+    def _merge_classifications(
+        self, transactions: List[Txn], classifications: List[Dict]
+    ) -> List[Txn]:
+        """Copy LLM classifications onto the transactions, in order"""
+        for i, transaction in enumerate(transactions):
+            if i < len(classifications):
+                classification = classifications[i]
+                transaction.is_membership = classification.get("is_membership", False)
+                transaction.membership_type = classification.get("membership_type")
+                transaction.frequency = classification.get("frequency")
+                transaction.category = classification.get(
+                    "category", transaction.merchant
+                )
+            else:
+                # Fallback for missing classifications
+                self._apply_rules(transaction)
+
+        return transactions
+
+    def _rule_based_classify(self, transactions: List[Txn]) -> List[Txn]:
         """Fallback rule-based classification"""
         classified = []
 
         for transaction in transactions:
-            result = self._classify_single(transaction)
-            transaction.update(result)
+            self._apply_rules(transaction)
             classified.append(transaction)
 
         return classified
 
-    def _classify_single(self, transaction: Dict) -> Dict:
+    def _apply_rules(self, transaction: Txn) -> None:
+        """Set the rule-based classification on a transaction"""
+        result = self._classify_single(transaction)
+        transaction.is_membership = result["is_membership"]
+        transaction.membership_type = result["membership_type"]
+        transaction.frequency = result["frequency"]
+        transaction.category = result["category"]
+
+    def _classify_single(self, transaction: Txn) -> Dict:
         """Classify a single transaction using rules"""
-        description = transaction.get("description", "").upper()
-        merchant = transaction.get("merchant", "").upper()
+        description = transaction.description.upper()
+        merchant = transaction.merchant.upper()
         text = f"{description} {merchant}"
 
-        # Common membership keywords
-        membership_keywords = [
-            "SUBSCRIPTION",
-            "MEMBERSHIP",
-            "MONTHLY",
-            "ANNUAL",
-            "RECURRING",
-            "NETFLIX",
-            "SPOTIFY",
-            "AMAZON PRIME",
-            "ADOBE",
-            "MICROSOFT 365",
-            "MICROSOFT",
-            "CURSOR",
-            "APPLE",
-            "GYM",
-            "FITNESS",
-            "GOLF",
-            "TENNIS",
-            "YOGI",
-            "PILATES",
-            "OFFICE",
-            "SOFTWARE",
-            "SaaS",
-            "CLOUD",
-            "NEWS",
-            "TIMES",
-            "JOURNAL",
-            "MAGAZINE",
-        ]
-
-        is_membership = any(keyword in text for keyword in membership_keywords)
+        # Every keyword occurring in the text, in one scan
+        tags = set()
+        for match in _KEYWORD_RE.finditer(text):
+            tags |= _KEYWORD_TAGS[match.group(1)]
 
-        # Determine type and category
-        import re
+        is_membership = _MEMBERSHIP in tags
 
+        # Determine type and category
         membership_type = None
         frequency = None
 
         # Clean merchant name for category (remove dates)
-        merchant_clean = merchant
-        if merchant_clean:
-            date_pattern = r"\d+\s+[A-ZÀÂÆÇÉÈÊËÎÏÔŒÙÛÜŸ]+\.?\s*"
-            merchant_clean = re.sub(date_pattern, "", merchant_clean)
-            abbrev_pattern = r"^[A-ZÀÂÆÇÉÈÊËÎÏÔŒÙÛÜŸ]+\.\s*"
-            merchant_clean = re.sub(abbrev_pattern, "", merchant_clean)
-            merchant_clean = re.sub(r"\d+", "", merchant_clean).strip()
+        merchant_clean = _normalize_merchant(merchant)
 
         if description:
             category = merchant_clean if merchant_clean else description.split()[0]
@@ -279,59 +628,13 @@ class MembershipClassifier:
             category = merchant_clean if merchant_clean else "Unknown"
 
         if is_membership:
-            if any(
-                k in text
-                for k in [
-                    "GYM",
-                    "FITNESS",
-                    "GOLF",
-                    "TENNIS",
-                    "YOGI",
-                    "PILATES",
-                    "SPORT",
-                ]
-            ):
-                membership_type = "Sport"
-            elif any(
-                k in text
-                for k in [
-                    "NETFLIX",
-                    "SPOTIFY",
-                    "DISNEY",
-                    "HULU",
-                    "PRIME VIDEO",
-                    "STREAMING",
-                ]
-            ):
-                membership_type = "Streaming"
-                frequency = "Monthly"
-            elif any(
-                k in text
-                for k in [
-                    "ADOBE",
-                    "MICROSOFT",
-                    "OFFICE",
-                    "SOFTWARE",
-                    "SaaS",
-                    "CURSOR",
-                    "APPLE",
-                ]
-            ):
-                membership_type = "Software"
-            elif any(k in text for k in ["NEWS", "TIMES", "JOURNAL", "MAGAZINE"]):
-                membership_type = "News"
-            else:
-                membership_type = "Services"
+            membership_type = next((t for t in _TYPE_KEYWORDS if t in tags), "Services")
 
             # Detect frequency
-            if "MONTHLY" in text or "MONTH" in text:
-                frequency = "Monthly"
-            elif "YEARLY" in text or "ANNUAL" in text or "YEAR" in text:
-                frequency = "Yearly"
-            elif "WEEKLY" in text or "WEEK" in text:
-                frequency = "Weekly"
-            else:
-                frequency = "Monthly"  # Default assumption
+            frequency = next(
+                (f for f in _FREQUENCY_KEYWORDS if f in tags),
+                "Monthly",  # Default assumption
+            )
 
         return {
             "is_membership": is_membership,
@@ -340,24 +643,17 @@ class MembershipClassifier:
             "category": category,
         }
 
-    def _filter_one_time_payments(self, transactions: List[Dict]) -> List[Dict]:
+    def _filter_one_time_payments(self, transactions: List[Txn]) -> List[Txn]:
         """Filter out one-time payments by analyzing frequency"""
-        import re
-
         # Group by normalized merchant name to count occurrences
         by_merchant = defaultdict(list)
 
         for t in transactions:
-            if t.get("is_membership"):
+            if t.is_membership:
                 # Normalize merchant name by removing dates and numbers
-                merchant = t.get("merchant", "").upper()
-                # Remove patterns like "21 DÉC.", "8 JUIL.", etc.
-                date_pattern = r"\d+\s+[A-ZÀÂÆÇÉÈÊËÎÏÔŒÙÛÜŸ]+\.?\s*"
-                merchant_clean = re.sub(date_pattern, "", merchant)
-                abbrev_pattern = r"^[A-ZÀÂÆÇÉÈÊËÎÏÔŒÙÛÜŸ]+\.\s*"
-                merchant_clean = re.sub(abbrev_pattern, "", merchant_clean)
-                # Remove remaining dates and numbers
-                merchant_clean = re.sub(r"\d+", "", merchant_clean).strip()
+                merchant_clean = t.norm_merchant
+                if merchant_clean is None:
+                    merchant_clean = _normalize_merchant(t.merchant)
                 if not merchant_clean:
                     merchant_clean = "Unknown"
                 by_merchant[merchant_clean].append(t)
@@ -367,58 +663,47 @@ class MembershipClassifier:
             if len(txns) == 1:
                 # Only one occurrence - likely a one-time payment
                 for t in txns:
-                    t["is_membership"] = False
-                    t["membership_type"] = None
-                    t["frequency"] = None
+                    t.is_membership = False
+                    t.membership_type = None
+                    t.frequency = None
 
         return transactions
 
-    def _add_monthly_costs(self, memberships: List[Dict]) -> List[Dict]:
+    def _add_monthly_costs(self, memberships: List[Txn]) -> List[Txn]:
         """Add monthly cost estimates to memberships"""
-        # Group by category to calculate averages
-        by_category = defaultdict(list)
+        # Running totals per category, with the first frequency seen
+        totals = defaultdict(float)
+        counts = defaultdict(int)
+        frequencies = {}
 
         for t in memberships:
-            category = t.get("category", "Unknown")
-            by_category[category].append(
-                {"amount": t["amount"], "frequency": t.get("frequency", "Monthly")}
-            )
+            totals[t.category] += t.amount
+            counts[t.category] += 1
+            frequencies.setdefault(t.category, t.frequency)
 
         # Calculate monthly costs for each category
-        for category, items in by_category.items():
-            amounts = [item["amount"] for item in items]
-            avg_amount = sum(amounts) / len(amounts)
-            frequency = items[0].get("frequency", "Monthly")
-
+        costs = {}
+        for category, total in totals.items():
+            avg_amount = total / counts[category]
             # Convert to monthly cost
-            if frequency == "Yearly":
-                monthly_cost = avg_amount / 12
-            elif frequency == "Weekly":
-                monthly_cost = avg_amount * 4.33
-            elif frequency == "Quarterly":
-                monthly_cost = avg_amount / 3
-            elif frequency == "Bi-annual":
-                monthly_cost = avg_amount / 6
-            else:  # Monthly
-                monthly_cost = avg_amount
-
-            # Add to all memberships in this category
-            for t in memberships:
-                if t.get("category") == category:
-                    t["monthly_cost"] = round(monthly_cost, 2)
-                    t["total_paid"] = sum(amounts)
+            multiplier, divisor = _FREQ_MULT.get(frequencies[category], (1, 1))
+            monthly_cost = avg_amount * multiplier / divisor
+            costs[category] = (round(monthly_cost, 2), total)
+
+        # Add to all memberships in each category
+        for t in memberships:
+            t.monthly_cost, t.total_paid = costs[t.category]
 
         return memberships
 
-    def analyze_frequency(self, transactions: List[Dict]) -> Dict:
+    def analyze_frequency(self, transactions: List[Txn]) -> Dict:
         """Analyze payment frequency patterns"""
         # Group by merchant/category
         by_category = defaultdict(list)
 
         for t in transactions:
-            if t.get("is_membership"):
-                category = t.get("category", "Unknown")
-                by_category[category].append({"date": t["date"], "amount": t["amount"]})
+            if t.is_membership:
+                by_category[t.category].append(t)
 
         # Analyze frequency for each category
         frequency_analysis = {}
@@ -427,17 +712,17 @@ class MembershipClassifier:
             if len(payments) < 2:
                 continue
 
-            # Sort by date
-            payments.sort(key=lambda x: x["date"])
-
-            # Calculate intervals
-            intervals = []
-            for i in range(1, len(payments)):
-                delta = payments[i]["date"] - payments[i - 1]["date"]
-                intervals.append(delta.days)
+            # Day gaps between consecutive payments (whole days, like
+            # timedelta.days)
+            dates = np.array([p.date for p in payments], dtype="datetime64[us]")
+            dates.sort()
+            intervals = np.diff(dates) // np.timedelta64(1, "D")
+            amounts = np.fromiter(
+                (p.amount for p in payments), dtype=np.float64, count=len(payments)
+            )
 
-            if intervals:
-                avg_interval = sum(intervals) / len(intervals)
+            if intervals.size:
+                avg_interval = float(intervals.mean())
 
                 # Classify frequency
                 if 25 <= avg_interval <= 35:
@@ -457,8 +742,8 @@ class MembershipClassifier:
                     "frequency": frequency,
                     "avg_interval_days": avg_interval,
                     "count": len(payments),
-                    "total_amount": sum(p["amount"] for p in payments),
-                    "avg_amount": (sum(p["amount"] for p in payments) / len(payments)),
+                    "total_amount": float(amounts.sum()),
+                    "avg_amount": float(amounts.mean()),
                 }
 
         return frequency_analysis
@@ -1,17 +1,39 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
+from sqlalchemy import func
 from sqlalchemy.orm import Session
-from typing import Optional
+from contextlib import asynccontextmanager
+from dataclasses import asdict
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+import asyncio
+import json
 import os
 
-from models import init_db, get_db, Transaction
+from models import init_db, get_db, SessionLocal, Transaction
 from bank_parser import BankStatementParser
 from email_parser import EmailParser
 from llm_classifier import MembershipClassifier
 from config import Config
+from transaction import Txn
 
-app = FastAPI(title="Membership Classifier")
+try:
+    import orjson
+
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Stop the PDF worker processes when the server shuts down"""
+    yield
+    bank_parser.close()
+
+
+app = FastAPI(title="Membership Classifier", lifespan=lifespan)
 
 # Initialize database
 init_db()
@@ -20,6 +42,7 @@ init_db()
 os.makedirs(Config.UPLOAD_DIR, exist_ok=True)
 os.makedirs(Config.STATEMENTS_DIR, exist_ok=True)
 os.makedirs(Config.EMAILS_DIR, exist_ok=True)
+os.makedirs(Config.BATCHES_DIR, exist_ok=True)
 
 # Initialize parsers and classifier
 bank_parser = BankStatementParser()
@@ -29,6 +52,50 @@ classifier = MembershipClassifier()
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+# Last /api/summary response body and the ETag of the table state it was
+# built from
+_summary_cache: Dict = {"etag": None, "body": None}
+
+
+def _transaction_rows(
+    transactions: List[Txn], source: str, is_membership: Optional[bool] = None
+) -> List[Dict]:
+    """Column mappings for a bulk insert of classified transactions"""
+    return [
+        {
+            "date": t.date,
+            "description": t.description,
+            "amount": t.amount,
+            "merchant": t.merchant,
+            "is_membership": (
+                t.is_membership if is_membership is None else is_membership
+            ),
+            "membership_type": t.membership_type,
+            "frequency": t.frequency,
+            "category": t.category,
+            "source": source,
+        }
+        for t in transactions
+    ]
+
+
+def _json_dumps(obj) -> bytes:
+    """Compact UTF-8 JSON, with orjson when it is installed"""
+    if HAS_ORJSON:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def _invalidate_summary():
+    """Drop the cached summary after the transactions table changed"""
+    _summary_cache["etag"] = None
+    _summary_cache["body"] = None
+
+
+def _pending_batch_path(batch_id: str) -> str:
+    """File holding the transactions of a submitted Batch API job"""
+    return os.path.join(Config.BATCHES_DIR, f"{os.path.basename(batch_id)}.json")
+
 
 @app.get("/", response_class=HTMLResponse)
 async def read_root():
@@ -55,43 +122,71 @@ async def get_model_info():
 
 
 @app.post("/api/upload/statement")
-async def upload_statement(file: UploadFile = File(...), db: Session = Depends(get_db)):
-    """Upload and parse a bank statement"""
+async def upload_statement(
+    file: UploadFile = File(...),
+    use_batch_api: bool = False,
+    db: Session = Depends(get_db),
+):
+    """Upload and parse a bank statement
+
+    With use_batch_api the AI classification goes through the provider Batch
+    API (half price, results within 24h); collect it with /api/batches/{id}.
+    """
     try:
         # Save file
         file_path = os.path.join(Config.STATEMENTS_DIR, file.filename)
         with open(file_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
+            # Copy in chunks so large uploads are never held in memory whole
+            while chunk := await file.read(1 << 20):
+                f.write(chunk)
 
-        # Parse based on file extension
+        # Parse based on file extension, off the event loop so other requests
+        # are still served while a large statement is parsed
         transactions = []
         if file.filename.endswith(".pdf"):
-            transactions = bank_parser.parse_pdf(file_path)
+            transactions = await asyncio.to_thread(bank_parser.parse_pdf, file_path)
         elif file.filename.endswith(".csv"):
-            transactions = bank_parser.parse_csv(file_path)
+            transactions = await asyncio.to_thread(bank_parser.parse_csv, file_path)
         else:
             raise HTTPException(status_code=400, detail="Unsupported file format")
 
+        if (
+            use_batch_api
+            and classifier.supports_batch_api
+            and Config.USE_AI_CLASSIFICATION
+        ):
+            batch_id = await classifier.classify_transactions_batch_api(transactions)
+            # None when nothing needs the LLM; the synchronous path below
+            # then finishes without any request
+            if batch_id is not None:
+                with open(_pending_batch_path(batch_id), "w") as f:
+                    json.dump(
+                        {
+                            "source": "bank_statement",
+                            "transactions": [asdict(t) for t in transactions],
+                        },
+                        f,
+                        default=str,
+                    )
+
+                return {
+                    "message": (
+                        f"Submitted {len(transactions)} transactions for batch "
+                        f"classification"
+                    ),
+                    "batch_id": batch_id,
+                    "count": 0,
+                }
+
         # Classify transactions - returns ONLY memberships
-        memberships = classifier.classify_transactions(transactions)
+        memberships = await classifier.classify_transactions(transactions)
 
         # Save to database - only memberships are returned now
-        for t in memberships:
-            db_transaction = Transaction(
-                date=t["date"],
-                description=t.get("description", ""),
-                amount=t["amount"],
-                merchant=t.get("merchant", ""),
-                is_membership=True,  # Always true since only memberships returned
-                membership_type=t.get("membership_type"),
-                frequency=t.get("frequency"),
-                category=t.get("category", ""),
-                source="bank_statement",
-            )
-            db.add(db_transaction)
-
+        # Always a membership since only memberships are returned
+        rows = _transaction_rows(memberships, "bank_statement", is_membership=True)
+        db.bulk_insert_mappings(Transaction, rows)
         db.commit()
+        _invalidate_summary()
 
         return {
             "message": (
@@ -112,34 +207,23 @@ async def upload_email(file: UploadFile = File(...), db: Session = Depends(get_d
         # Save file
         file_path = os.path.join(Config.EMAILS_DIR, file.filename)
         with open(file_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
+            # Copy in chunks so large uploads are never held in memory whole
+            while chunk := await file.read(1 << 20):
+                f.write(chunk)
 
         # Parse email
-        transactions = email_parser.parse_email_file(file_path)
+        transactions = await asyncio.to_thread(email_parser.parse_email_file, file_path)
 
         if not transactions:
             return {"message": "No transactions found in email", "count": 0}
 
         # Classify transactions
-        classified = classifier.classify_transactions(transactions)
+        classified = await classifier.classify_transactions(transactions)
 
         # Save to database
-        for t in classified:
-            db_transaction = Transaction(
-                date=t["date"],
-                description=t.get("description", ""),
-                amount=t["amount"],
-                merchant=t.get("merchant", ""),
-                is_membership=t.get("is_membership", False),
-                membership_type=t.get("membership_type"),
-                frequency=t.get("frequency"),
-                category=t.get("category", ""),
-                source="email",
-            )
-            db.add(db_transaction)
-
+        db.bulk_insert_mappings(Transaction, _transaction_rows(classified, "email"))
         db.commit()
+        _invalidate_summary()
 
         return {
             "message": f"Processed {len(classified)} transactions",
@@ -164,24 +248,12 @@ async def fetch_emails(
             return {"message": "No transactions found in emails", "count": 0}
 
         # Classify transactions
-        classified = classifier.classify_transactions(transactions)
+        classified = await classifier.classify_transactions(transactions)
 
         # Save to database
-        for t in classified:
-            db_transaction = Transaction(
-                date=t["date"],
-                description=t.get("description", ""),
-                amount=t["amount"],
-                merchant=t.get("merchant", ""),
-                is_membership=t.get("is_membership", False),
-                membership_type=t.get("membership_type"),
-                frequency=t.get("frequency"),
-                category=t.get("category", ""),
-                source="email",
-            )
-            db.add(db_transaction)
-
+        db.bulk_insert_mappings(Transaction, _transaction_rows(classified, "email"))
         db.commit()
+        _invalidate_summary()
 
         return {
             "message": f"Processed {len(classified)} transactions",
@@ -192,81 +264,169 @@ async def fetch_emails(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/batches/{batch_id}")
+async def collect_batch(batch_id: str, db: Session = Depends(get_db)):
+    """Save the results of a Batch API classification once it has finished"""
+    path = _pending_batch_path(batch_id)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Unknown batch")
+
+    try:
+        with open(path) as f:
+            pending = json.load(f)
+        transactions = [
+            Txn(**{**t, "date": datetime.fromisoformat(t["date"])})
+            for t in pending["transactions"]
+        ]
+
+        status, memberships = await classifier.collect_batch_results(
+            batch_id, transactions
+        )
+        if memberships is None:
+            return {"message": f"Batch is {status}", "status": status, "count": 0}
+
+        rows = _transaction_rows(memberships, pending["source"], is_membership=True)
+        db.bulk_insert_mappings(Transaction, rows)
+        db.commit()
+        _invalidate_summary()
+        os.remove(path)
+
+        return {
+            "message": (
+                f"Found {len(memberships)} recurring memberships "
+                f"from {len(transactions)} total transactions"
+            ),
+            "status": status,
+            "count": len(memberships),
+        }
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def _stream_transactions(
+    is_membership: Optional[bool], membership_type: Optional[str]
+) -> Iterator[bytes]:
+    """Encode matching transactions as a JSON array, 500 rows per chunk"""
+    # Own session: the response body is produced after the endpoint returns
+    db = SessionLocal()
+    try:
+        query = db.query(Transaction)
+
+        if is_membership is not None:
+            query = query.filter(Transaction.is_membership == is_membership)
+
+        if membership_type:
+            query = query.filter(Transaction.membership_type == membership_type)
+
+        yield b"["
+        chunk = []
+        first = True
+        for t in query.order_by(Transaction.date.desc()).yield_per(500):
+            chunk.append(
+                _json_dumps(
+                    {
+                        "id": t.id,
+                        "date": t.date.isoformat(),
+                        "description": t.description,
+                        "amount": t.amount,
+                        "merchant": t.merchant,
+                        "is_membership": t.is_membership,
+                        "membership_type": t.membership_type,
+                        "frequency": t.frequency,
+                        "category": t.category,
+                        "source": t.source,
+                    }
+                )
+            )
+            if len(chunk) == 500:
+                yield (b"" if first else b",") + b",".join(chunk)
+                chunk = []
+                first = False
+        if chunk:
+            yield (b"" if first else b",") + b",".join(chunk)
+        yield b"]"
+    finally:
+        db.close()
+
+
 @app.get("/api/transactions")
 async def get_transactions(
     is_membership: Optional[bool] = None,
     membership_type: Optional[str] = None,
-    db: Session = Depends(get_db),
 ):
     """Get all transactions with optional filters"""
-    query = db.query(Transaction)
+    return StreamingResponse(
+        _stream_transactions(is_membership, membership_type),
+        media_type="application/json",
+    )
 
-    if is_membership is not None:
-        query = query.filter(Transaction.is_membership == is_membership)
 
-    if membership_type:
-        query = query.filter(Transaction.membership_type == membership_type)
+def _build_summary(db: Session) -> Dict:
+    """Expenses grouped by type and category, with monthly estimates"""
+    membership = Transaction.is_membership.is_(True)
+    mtype_col = func.coalesce(func.nullif(Transaction.membership_type, ""), "Other")
+    category_col = func.coalesce(func.nullif(Transaction.category, ""), "Unknown")
 
-    transactions = query.order_by(Transaction.date.desc()).all()
+    # Sum and count per type and per category in SQL, keeping the groups in
+    # order of first appearance
+    type_totals = (
+        db.query(mtype_col, func.sum(Transaction.amount), func.count())
+        .filter(membership)
+        .group_by(mtype_col)
+        .order_by(func.min(Transaction.id))
+    )
+    category_totals = (
+        db.query(category_col, func.sum(Transaction.amount), func.count())
+        .filter(membership)
+        .group_by(category_col)
+        .order_by(func.min(Transaction.id))
+    )
 
-    return [
-        {
-            "id": t.id,
-            "date": t.date.isoformat(),
-            "description": t.description,
-            "amount": t.amount,
-            "merchant": t.merchant,
-            "is_membership": t.is_membership,
-            "membership_type": t.membership_type,
-            "frequency": t.frequency,
-            "category": t.category,
-            "source": t.source,
+    by_type = {
+        mtype: {"total": total, "count": count, "categories": {}}
+        for mtype, total, count in type_totals
+    }
+    by_category = {
+        category: {
+            "total": total,
+            "count": count,
+            "frequency": None,
+            "membership_type": None,
+            "transactions": [],
         }
-        for t in transactions
-    ]
-
+        for category, total, count in category_totals
+    }
 
-@app.get("/api/summary")
-async def get_summary(db: Session = Depends(get_db)):
-    """Get summary of expenses grouped by type"""
-    # Get all membership transactions
-    memberships = (
-        db.query(Transaction).filter(Transaction.is_membership.is_(True)).all()
+    # Transaction details, only the columns the summary shows
+    details = (
+        db.query(
+            category_col,
+            mtype_col,
+            Transaction.frequency,
+            Transaction.date,
+            Transaction.amount,
+            Transaction.merchant,
+        )
+        .filter(membership)
+        .order_by(Transaction.id)
     )
-
-    # Group by membership type
-    by_type = {}
-    by_category = {}
-
-    for t in memberships:
-        # Group by type
-        mtype = t.membership_type or "Other"
-        if mtype not in by_type:
-            by_type[mtype] = {"total": 0, "count": 0, "categories": {}}
-
-        by_type[mtype]["total"] += t.amount
-        by_type[mtype]["count"] += 1
-
-        # Group by category
-        category = t.category or "Unknown"
-        if category not in by_category:
-            by_category[category] = {
-                "total": 0,
-                "count": 0,
-                "frequency": t.frequency,
-                "membership_type": mtype,
-                "transactions": [],
-            }
-
-        by_category[category]["total"] += t.amount
-        by_category[category]["count"] += 1
-
-        # Add transaction details
-        by_category[category]["transactions"].append(
+    for category, mtype, frequency, date, amount, merchant in details:
+        data = by_category.get(category)
+        if data is None:
+            # Inserted after the totals were taken
+            continue
+
+        # Frequency and type come from the first transaction of the category
+        if not data["transactions"]:
+            data["frequency"] = frequency
+            data["membership_type"] = mtype
+
+        data["transactions"].append(
             {
-                "date": t.date.isoformat(),
-                "amount": t.amount,
-                "merchant": t.merchant,
+                "date": date.isoformat(),
+                "amount": amount,
+                "merchant": merchant,
             }
         )
 
@@ -297,7 +457,7 @@ async def get_summary(db: Session = Depends(get_db)):
         )
 
     # Calculate totals
-    total_membership_spending = sum(t.amount for t in memberships)
+    total_membership_spending = sum(t["total"] for t in by_type.values())
     total_monthly_estimate = sum(c["monthly_estimate"] for c in by_category.values())
 
     return {
@@ -309,6 +469,30 @@ async def get_summary(db: Session = Depends(get_db)):
     }
 
 
+@app.get("/api/summary")
+async def get_summary(request: Request, db: Session = Depends(get_db)):
+    """Get summary of expenses grouped by type
+
+    The response carries an ETag of the table state; it is rebuilt only
+    when the table changed, and clients sending a matching If-None-Match
+    get 304 Not Modified.
+    """
+    latest, count = db.query(func.max(Transaction.created_at), func.count()).one()
+    etag = f'"{count}-{latest.timestamp() if latest else 0}"'
+    headers = {"ETag": etag}
+
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    if _summary_cache["etag"] != etag:
+        _summary_cache["body"] = _json_dumps(_build_summary(db))
+        _summary_cache["etag"] = etag
+
+    return Response(
+        _summary_cache["body"], media_type="application/json", headers=headers
+    )
+
+
 @app.get("/api/frequency-analysis")
 async def get_frequency_analysis(db: Session = Depends(get_db)):
     """Get frequency analysis for recurring payments"""
@@ -316,18 +500,19 @@ async def get_frequency_analysis(db: Session = Depends(get_db)):
         db.query(Transaction).filter(Transaction.is_membership.is_(True)).all()
     )
 
-    # Convert to dict format
-    transactions_dict = [
-        {
-            "date": t.date,
-            "amount": t.amount,
-            "category": t.category,
-            "merchant": t.merchant,
-        }
+    # Convert to classifier records
+    transactions = [
+        Txn(
+            date=t.date,
+            amount=t.amount,
+            merchant=t.merchant,
+            is_membership=t.is_membership,
+            category=t.category,
+        )
         for t in memberships
     ]
 
-    analysis = classifier.analyze_frequency(transactions_dict)
+    analysis = classifier.analyze_frequency(transactions)
 
     return analysis
 
@@ -337,6 +522,7 @@ async def clear_transactions(db: Session = Depends(get_db)):
     """Clear all transactions from database"""
     db.query(Transaction).delete()
     db.commit()
+    _invalidate_summary()
     return {"message": "All transactions cleared"}
 
 
@@ -1,4 +1,14 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Boolean
+from sqlalchemy import (
+    create_engine,
+    Column,
+    Integer,
+    String,
+    Float,
+    DateTime,
+    Boolean,
+    Index,
+    event,
+)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
@@ -22,15 +32,45 @@ class Transaction(Base):
     source = Column(String)  # "bank_statement" or "email"
     created_at = Column(DateTime, default=datetime.utcnow)
 
+    # Memberships are filtered on is_membership and then grouped by category
+    # or sorted by date
+    __table_args__ = (
+        Index("ix_txn_member_category", "is_membership", "category"),
+        Index("ix_txn_member_date", "is_membership", "date"),
+    )
+
 
 # Database setup
-engine = create_engine(Config.DATABASE_URL, connect_args={"check_same_thread": False})
+engine = create_engine(
+    Config.DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    pool_size=5,
+    max_overflow=10,
+)
+
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Use WAL so summary and list requests can read while an upload writes"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
 def init_db():
     Base.metadata.create_all(bind=engine)
 
+    # create_all skips tables that already exist, so add any newer indexes
+    # to databases created before them
+    for index in Transaction.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
+
 
 def get_db():
     db = SessionLocal()
@@ -38,4 +78,3 @@ def get_db():
         yield db
     finally:
         db.close()
-
@@ -0,0 +1,21 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+
+@dataclass(slots=True)
+class Txn:
+    """A parsed transaction, plus its membership details once classified"""
+
+    date: datetime
+    amount: float
+    merchant: str
+    description: str = ""
+    is_membership: bool = False
+    membership_type: Optional[str] = None  # e.g., "Sport", "Software"
+    frequency: Optional[str] = None  # e.g., "Monthly", "Yearly"
+    category: Optional[str] = "Unknown"  # e.g., "Gym", "Netflix"
+    monthly_cost: Optional[float] = None
+    total_paid: Optional[float] = None
+    # Merchant without dates and numbers, set by the classifier
+    norm_merchant: Optional[str] = None